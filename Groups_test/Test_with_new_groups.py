@@ -1,23 +1,65 @@
 import os
-import json
-import pdfkit
+import time
+import random
+import orjson
+from html import escape
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import requests as req
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from msal import ConfidentialClientApplication
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
+
+# ------------------ HTTP Session ------------------
+# One pooled session so Graph calls reuse keep-alive connections instead of a new TLS handshake each time
+SESSION = req.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    # 429/503 throttling is handled by graph_request so POSTs are covered too
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 504], raise_on_status=False),
+))
+MAX_THROTTLE_RETRIES = 5
+
+def graph_request(method, url, **kwargs):
+    """Send a Graph request, waiting out 429/503 throttling via Retry-After or jittered exponential backoff."""
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        response = SESSION.request(method, url, **kwargs)
+        if response.status_code not in (429, 503) or attempt == MAX_THROTTLE_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+        time.sleep(delay + random.uniform(0, 1))
 
 # ------------------ Authentication ------------------
 filter_query = os.environ.get('GROUPS_FILTER')
-def get_token():
-    tenant_id = os.environ.get('TENANT_ID')
-    client_id = os.environ.get('CLIENT_ID')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    
-    if not all([tenant_id, client_id, client_secret]):
-        raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+_msal_app = None
+
+def get_msal_app():
+    # Build the MSAL client once so its in-memory token cache is shared across calls
+    global _msal_app
+    if _msal_app is None:
+        tenant_id = os.environ.get('TENANT_ID')
+        client_id = os.environ.get('CLIENT_ID')
+        client_secret = os.environ.get('CLIENT_SECRET')
+
+        if not all([tenant_id, client_id, client_secret]):
+            raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
 
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
-    token_result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+        authority = f"https://login.microsoftonline.com/{tenant_id}"
+        _msal_app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
+    return _msal_app
+
+def get_token():
+    app = get_msal_app()
+    token_result = app.acquire_token_silent(GRAPH_SCOPES, account=None)
+    if not token_result:
+        token_result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
 
     if "access_token" in token_result:
         return token_result["access_token"]
@@ -25,68 +67,132 @@ def get_token():
         raise Exception(f"Token error: {token_result.get('error_description')}")
 
 # ------------------ Group Fetching ------------------
-def get_groups():
-    token = get_token()
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
 
+def get_groups(headers):
+    url = f"{GRAPH_BASE_URL}/groups?$select=id,displayName&$top=999"
     if filter_query:
-        url = f"https://graph.microsoft.com/v1.0/groups?{filter_query}"
-    else:
-        url = "https://graph.microsoft.com/v1.0/groups"
-
-    response = req.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json().get("value", [])
+        url += f"&{filter_query}"
+
+    # Follow @odata.nextLink so tenants with more groups than one page aren't truncated
+    groups = []
+    while url:
+        response = graph_request("GET", url, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        groups.extend(data.get("value", []))
+        url = data.get("@odata.nextLink")
+    return groups
+
+GRAPH_BATCH_URL = f"{GRAPH_BASE_URL}/$batch"
+# Cap concurrent $batch posts so parallel fan-out doesn't trip Graph throttling (429)
+MAX_BATCH_WORKERS = 8
+
+MAX_BATCH_ATTEMPTS = 5
+
+def post_batch(batch_payload, headers):
+    """POST a $batch payload and return its sub-responses, re-sending any that come back throttled."""
+    responses = {}
+    pending = batch_payload["requests"]
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+        response = graph_request("POST", GRAPH_BATCH_URL, headers=headers, json={"requests": pending})
+        response.raise_for_status()
+
+        throttled = set()
+        retry_after = 1
+        for result in orjson.loads(response.content)["responses"]:
+            if result["status"] == 429 and attempt < MAX_BATCH_ATTEMPTS:
+                throttled.add(result["id"])
+                retry_after = max(retry_after, int(result.get("headers", {}).get("Retry-After", 1)))
+            else:
+                responses[result["id"]] = result
+
+        if not throttled:
+            break
+        time.sleep(retry_after)
+        pending = [r for r in pending if r["id"] in throttled]
+    return list(responses.values())
 
 def get_all_group_members():
     token = get_token()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    groups = get_groups()
+    groups = get_groups(headers)
     group_members = {}
-    batch_requests = []
     batch_size = 20
-    batch_counter = 1
-
-    for group in groups:
-        batch_requests.append({
-            "id": str(batch_counter),
-            "method": "GET",
-            "url": f"/groups/{group['id']}/members"
-        })
-        batch_counter += 1
-
-        if len(batch_requests) == batch_size or group == groups[-1]:
-            batch_payload = {"requests": batch_requests}
-            response = req.post("https://graph.microsoft.com/v1.0/$batch", headers=headers, json=batch_payload)
-            response.raise_for_status()
-
-            results = response.json()["responses"]
-            for result in results:
-                idx = int(result["id"]) - 1
-                group_name = groups[idx]["displayName"]
-                if result["status"] == 200:
-                    members = [m["displayName"] for m in result["body"].get("value", [])]
-                    group_members[group_name] = members
-            batch_requests = []
+    # (group name, relative URL) for every member page still to be fetched
+    pending = [
+        (group["displayName"], f"/groups/{group['id']}/members?$select=displayName&$top=999")
+        for group in groups
+    ]
 
+    # Batches are independent of each other, so post them concurrently.
+    # Paged member lists come back with a nextLink, which is queued into the next round of batches.
+    with ThreadPoolExecutor(max_workers=MAX_BATCH_WORKERS) as executor:
+        while pending:
+            chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            # Sub-request ids are the position inside their own batch, so each response maps straight back to its chunk
+            batch_payloads = [
+                {"requests": [{"id": str(i), "method": "GET", "url": url} for i, (_, url) in enumerate(chunk)]}
+                for chunk in chunks
+            ]
+            pending = []
+
+            for chunk, results in zip(chunks, executor.map(lambda payload: post_batch(payload, headers), batch_payloads)):
+                for result in results:
+                    group_name = chunk[int(result["id"])][0]
+                    # A dropped page would show up as deleted groups or removed members, so fail the run instead
+                    if result["status"] != 200:
+                        raise Exception(f"Member fetch failed for '{group_name}' ({result['status']}): {result.get('body')}")
+                    body = result["body"]
+                    members = [m["displayName"] for m in body.get("value", [])]
+                    group_members.setdefault(group_name, []).extend(members)
+
+                    next_link = body.get("@odata.nextLink")
+                    if next_link:
+                        pending.append((group_name, next_link.replace(GRAPH_BASE_URL, "", 1)))
+
+    # Keep member lists de-duplicated and sorted so snapshots can be diffed with a linear merge;
+    # displayName is not unique, and the comparison treats members as a set of names
+    for group, members in group_members.items():
+        group_members[group] = sorted(set(members))
     return group_members
 
 # ------------------ Snapshot Handling ------------------
 def load_previous_snapshot():
     path = os.path.join(os.environ.get("PIPELINE_WORKSPACE", "./"),"group-report-artifacts","previous_snapshot.json")
     if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(path, 'rb') as f:
+            data = orjson.loads(f.read())
+        # Snapshots from older runs may hold duplicate names or be unsorted
+        return {group: sorted(set(members)) for group, members in data.items()}
     print("No previous snapshot found, treating this as first run.")
     return {}
 
-def save_current_snapshot(data):
-    artifacts_dir = os.environ.get('BUILD_ARTIFACTSTAGINGDIRECTORY', './pipeline-artifacts')
-    os.makedirs(artifacts_dir, exist_ok=True)
-    with open(os.path.join(artifacts_dir, 'previous_snapshot.json'), 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2)
+def save_current_snapshot(data, artifacts_dir):
+    # Only read back by the next run, so it is written compact
+    with open(os.path.join(artifacts_dir, 'previous_snapshot.json'), 'wb') as f:
+        f.write(orjson.dumps(data))
 
 # ------------------ Comparison Logic ------------------
+def diff_sorted_members(cur, prev):
+    """Merge-walk two sorted member lists into sorted (added, removed, unchanged) lists."""
+    added, removed, unchanged = [], [], []
+    i = j = 0
+    while i < len(cur) and j < len(prev):
+        if cur[i] == prev[j]:
+            unchanged.append(cur[i])
+            i += 1
+            j += 1
+        elif cur[i] < prev[j]:
+            added.append(cur[i])
+            i += 1
+        else:
+            removed.append(prev[j])
+            j += 1
+    added += cur[i:]
+    removed += prev[j:]
+    return added, removed, unchanged
+
 def compare_snapshots(current, previous):
     result = {}
     added_groups = []
@@ -94,15 +200,13 @@ def compare_snapshots(current, previous):
     all_keys = set(current.keys()).union(previous.keys())
     changes_detected = False
 
+    # Snapshots hold sorted member lists, so no per-group sets or re-sorting are needed
     for group in all_keys:
-        cur_members = set(current.get(group, []))
-        prev_members = set(previous.get(group, []))
-
         # Check if group is added
         if group not in previous:
             added_groups.append(group)
             result[group] = {
-                'added': sorted(current[group]),
+                'added': list(current[group]),
                 'removed': [],
                 'unchanged': []
             }
@@ -113,100 +217,154 @@ def compare_snapshots(current, previous):
             deleted_groups.append(group)
             result[group] = {   
                 'added': [],
-                'removed': sorted(previous[group]),
+                'removed': list(previous[group]),
                 'unchanged': []
             }
             changes_detected = True
 
+        # Most groups don't change between runs; identical sorted lists need no diff at all
+        elif current[group] == previous[group]:
+            result[group] = {
+                'added': [],
+                'removed': [],
+                'unchanged': current[group]
+            }
+
         # Check if group has changes
         else:
-            added = list(cur_members - prev_members)
-            removed = list(prev_members - cur_members)
-            unchanged = list(cur_members & prev_members)
+            added, removed, unchanged = diff_sorted_members(current[group], previous[group])
 
             if added or removed:
                 changes_detected = True
             result[group] = {
-                'added': sorted(added),
-                'removed': sorted(removed),
-                'unchanged': sorted(cur_members & prev_members)
+                'added': added,
+                'removed': removed,
+                'unchanged': unchanged
             }
     return result, changes_detected, added_groups, deleted_groups
 
 #-------------------Generate Report----------
-def generate_html_report(snapshot, output_path, added_groups, deleted_groups):
-    html = [
-        "<html><head><style>",
-        "body { font-family: Arial, sans-serif; }",
-        "h2 { color: #333; }",
-        ".added { color: green; }",
-        ".removed { color: darkorange; }",
-        ".unchanged { color: black; }",
-        "table { border-collapse: collapse; width: 100%; }",
-        "th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }",
-        "</style></head><body>",
-        "<h1>Azure AD Group Membership Report</h1>"
-    ]
-
-    # Add added and deleted groups
-    if added_groups:
-        html.append("<h2>Added Groups</h2>")
-        for group in added_groups:
-            html.append(f"<p>{group}</p>")
-        html.append("<br>")
-
-    if deleted_groups:
-        html.append("<h2>Deleted Groups</h2>")
-        for group in deleted_groups:
-            html.append(f"<p>{group}</p>")
-        html.append("<br>")
-
-    # Separate changed and unchanged groups
-    changed_groups = {}
-    unchanged_groups = {}
-    for group, data in snapshot.items():
+REPORT_WRITE_BUFFER = 64 * 1024
+CHANGE_LABELS = {"added": "Added", "removed": "Removed", "unchanged": "Unchanged"}
+
+def split_changed_groups(snapshot):
+    # Sort group names alphabetically once, then split into changed and unchanged
+    changed_sorted = []
+    unchanged_sorted = []
+    for group, data in sorted(snapshot.items()):
         if data["added"] or data["removed"]:
-            changed_groups[group] = data
+            changed_sorted.append((group, data))
         else:
-            unchanged_groups[group] = data
+            unchanged_sorted.append((group, data))
+    return changed_sorted, unchanged_sorted
+
+def generate_html_report(snapshot, output_path, added_groups, deleted_groups):
+    changed_sorted, unchanged_sorted = split_changed_groups(snapshot)
+
+    # Rows are written straight to the file as they are produced instead of
+    # collecting the whole document in a list and joining it at the end
+    with open(output_path, 'w', encoding='utf-8', buffering=REPORT_WRITE_BUFFER) as f:
+        def write(line):
+            f.write(line)
+            f.write("\n")
+
+        write("<html><head><style>")
+        write("body { font-family: Arial, sans-serif; }")
+        write("h2 { color: #333; }")
+        write(".added { color: green; }")
+        write(".removed { color: darkorange; }")
+        write(".unchanged { color: black; }")
+        write("table { border-collapse: collapse; width: 100%; }")
+        write("th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }")
+        write("</style></head><body>")
+        write("<h1>Azure AD Group Membership Report</h1>")
+
+        # Add added and deleted groups
+        if added_groups:
+            write("<h2>Added Groups</h2>")
+            for group in added_groups:
+                write(f"<p>{escape(group)}</p>")
+            write("<br>")
+
+        if deleted_groups:
+            write("<h2>Deleted Groups</h2>")
+            for group in deleted_groups:
+                write(f"<p>{escape(group)}</p>")
+            write("<br>")
+
+        def append_group_section(groups):
+            for group, data in groups:
+                write(f"<h2>{escape(group)}</h2>")
+                write("<table><tr><th>Change Type</th><th>Members</th></tr>")
+                for change_type, label in CHANGE_LABELS.items():
+                    members = data.get(change_type, ())
+                    if members:
+                        # Rows go to the buffered file one by one; no per-section string is built
+                        cell = f"<tr><td class='{change_type}'>{label}</td><td class='{change_type}'>"
+                        f.writelines(f"{cell}{escape(member)}</td></tr>\n" for member in members)
+                write("</table><br>")
+
+        # Display groups with changes first
+        write("<h1>Groups With Changes</h1>")
+        if changed_sorted:
+            append_group_section(changed_sorted)
+        else:
+            write("<p>No changes detected in any group.</p>")
+
+        # Then the remaining groups; changed groups were already rendered in full above
+        write("<h1>Groups Without Changes</h1>")
+        append_group_section(unchanged_sorted)
+
+        write("</body></html>")
+
+#-------------------Generate PDF Report----------
+PDF_CHANGE_COLORS = {"added": colors.green, "removed": colors.darkorange, "unchanged": colors.black}
+
+def generate_pdf_report(snapshot, pdf_path, added_groups, deleted_groups):
+    # Build the PDF in-process with ReportLab from the snapshot itself,
+    # rather than shelling out to wkhtmltopdf to re-render the HTML file
+    changed_sorted, unchanged_sorted = split_changed_groups(snapshot)
+    styles = getSampleStyleSheet()
+    story = [Paragraph("Azure AD Group Membership Report", styles['Title'])]
+
+    for title, groups in (("Added Groups", added_groups), ("Deleted Groups", deleted_groups)):
+        if groups:
+            story.append(Paragraph(title, styles['Heading2']))
+            for group in groups:
+                story.append(Paragraph(escape(group), styles['Normal']))
+            story.append(Spacer(1, 12))
 
     def append_group_section(groups):
         for group, data in groups:
-            html.append(f"<h2>{group}</h2>")
-            html.append("<table><tr><th>Change Type</th><th>Members</th></tr>")
-            for change_type in ["added", "removed", "unchanged"]:
-                class_name = change_type
-                for member in data.get(change_type, []):
-                    html.append(f"<tr><td class='{class_name}'>{change_type.capitalize()}</td><td class='{class_name}'>{member}</td></tr>")
-            html.append("</table><br>")
-
-    # Sort group names alphabetically
-    changed_sorted = sorted(changed_groups.items())
-    unchanged_sorted = sorted(unchanged_groups.items())
-
-    # Display groups with changes first
-    html.append("<h1>Groups With Changes</h1>")
+            story.append(Paragraph(escape(group), styles['Heading2']))
+            rows = [["Change Type", "Members"]]
+            table_style = [
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ]
+            for change_type, label in CHANGE_LABELS.items():
+                members = data.get(change_type, ())
+                if members:
+                    first_row = len(rows)
+                    rows.extend([label, member] for member in members)
+                    table_style.append(('TEXTCOLOR', (0, first_row), (-1, len(rows) - 1), PDF_CHANGE_COLORS[change_type]))
+            # LongTable splits big groups across pages without laying out the whole table at once
+            story.append(LongTable(rows, repeatRows=1, hAlign='LEFT', style=TableStyle(table_style)))
+            story.append(Spacer(1, 12))
+
+    story.append(Paragraph("Groups With Changes", styles['Heading1']))
     if changed_sorted:
         append_group_section(changed_sorted)
     else:
-        html.append("<p>No changes detected in any group.</p>")
-
-    # Then all groups sorted alphabetically
-    html.append("<h1>All Groups</h1>")
-    all_sorted_groups = changed_sorted + unchanged_sorted
+        story.append(Paragraph("No changes detected in any group.", styles['Normal']))
 
-    append_group_section(sorted(all_sorted_groups))
+    story.append(Paragraph("Groups Without Changes", styles['Heading1']))
+    append_group_section(unchanged_sorted)
 
-    html.append("</body></html>")
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
-
-#-------------------Generate PDF Report----------
-def generate_pdf_report(html_path, pdf_path):
-    pdfkit.from_file(html_path, pdf_path)
+    SimpleDocTemplate(pdf_path, pagesize=A4).build(story)
     print(f"PDF report saved to: {pdf_path}")
-   
+
 
 
 # ------------------ Entry ------------------
@@ -222,17 +380,17 @@ def main():
     if not previous:
         print("No previous snapshot found. This is likely the first run.")
         print("Saving current snapshot for future comparison.")
-        save_current_snapshot(current)
+        save_current_snapshot(current, artifacts_dir)
         return
 
     snapshot, changes_detected, added_groups, deleted_groups = compare_snapshots(current, previous)
-    save_current_snapshot(current)
+    save_current_snapshot(current, artifacts_dir)
 
     print("Snapshot comparison complete.")
 
     # Save comparison result
-    with open(os.path.join(artifacts_dir, 'comparison_result.json'), 'w', encoding='utf-8') as f:
-        json.dump(snapshot, f, indent=2)
+    with open(os.path.join(artifacts_dir, 'comparison_result.json'), 'wb') as f:
+        f.write(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2))
 
     # Generate HTML report
     html_report_path = os.path.join(artifacts_dir, 'group_membership_report.html')
@@ -241,7 +399,7 @@ def main():
 
     # Generate PDF report
     pdf_report_path = os.path.join(artifacts_dir, 'group_membership_report.pdf')
-    generate_pdf_report(html_report_path, pdf_report_path)
+    generate_pdf_report(snapshot, pdf_report_path, added_groups, deleted_groups)
 
 if __name__ == "__main__":
     main()
@@ -1,23 +1,67 @@
 import os
 import json
+import time
+import random
 import pdfkit
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import requests as req
+from html import escape
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from msal import ConfidentialClientApplication
 
+# ------------------ HTTP Session ------------------
+# One pooled session so Graph calls reuse keep-alive connections instead of a new TLS handshake each time
+SESSION = req.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        # 429/503 throttling is handled by graph_request so POSTs are covered too
+        status_forcelist=[500, 502, 504],
+        raise_on_status=False,
+    ),
+))
+MAX_THROTTLE_RETRIES = 5
+
+def graph_request(method, url, **kwargs):
+    """Send a Graph request, waiting out 429/503 throttling via Retry-After or jittered exponential backoff."""
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        response = SESSION.request(method, url, **kwargs)
+        if response.status_code not in (429, 503) or attempt == MAX_THROTTLE_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+        time.sleep(delay + random.uniform(0, 1))
+
 # ------------------ Authentication ------------------
 filter_query = os.environ.get('GROUPS_FILTER')
-def get_token():
-    tenant_id = os.environ.get('TENANT_ID')
-    client_id = os.environ.get('CLIENT_ID')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    
-    if not all([tenant_id, client_id, client_secret]):
-        raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+_msal_app = None
+
+def get_msal_app():
+    # Build the MSAL client once so its in-memory token cache is shared across calls
+    global _msal_app
+    if _msal_app is None:
+        tenant_id = os.environ.get('TENANT_ID')
+        client_id = os.environ.get('CLIENT_ID')
+        client_secret = os.environ.get('CLIENT_SECRET')
 
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
-    token_result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+        if not all([tenant_id, client_id, client_secret]):
+            raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+
+        authority = f"https://login.microsoftonline.com/{tenant_id}"
+        _msal_app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
+    return _msal_app
+
+def get_token():
+    app = get_msal_app()
+    token_result = app.acquire_token_silent(GRAPH_SCOPES, account=None)
+    if not token_result:
+        token_result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
 
     if "access_token" in token_result:
         return token_result["access_token"]
@@ -29,45 +73,88 @@ def get_groups():
     token = get_token()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
+    url = "https://graph.microsoft.com/v1.0/groups?$select=id,displayName&$top=999"
     if filter_query:
-        url = f"https://graph.microsoft.com/v1.0/groups?{filter_query}"
-    else:
-        url = "https://graph.microsoft.com/v1.0/groups"
-
-    response = req.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json().get("value", [])
+        url += f"&{filter_query}"
+
+    # Follow @odata.nextLink so tenants with more groups than one page aren't truncated
+    groups = []
+    while url:
+        response = graph_request("GET", url, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        groups.extend(data.get("value", []))
+        url = data.get("@odata.nextLink")
+    return groups
+
+GRAPH_BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+# Cap concurrent $batch posts so parallel fan-out doesn't trip Graph throttling (429)
+MAX_BATCH_WORKERS = 8
+
+MAX_BATCH_ATTEMPTS = 5
+
+def post_batch(batch_payload, headers):
+    """POST a $batch payload and return its sub-responses, re-sending any that come back throttled."""
+    responses = {}
+    pending = batch_payload["requests"]
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+        response = graph_request("POST", GRAPH_BATCH_URL, headers=headers, json={"requests": pending})
+        response.raise_for_status()
+
+        throttled = set()
+        retry_after = 1
+        for result in response.json()["responses"]:
+            if result["status"] == 429 and attempt < MAX_BATCH_ATTEMPTS:
+                throttled.add(result["id"])
+                retry_after = max(retry_after, int(result.get("headers", {}).get("Retry-After", 1)))
+            else:
+                responses[result["id"]] = result
+
+        if not throttled:
+            break
+        time.sleep(retry_after)
+        pending = [r for r in pending if r["id"] in throttled]
+    return list(responses.values())
 
 def get_all_group_members():
     token = get_token()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     groups = get_groups()
     group_members = {}
-    batch_requests = []
     batch_size = 20
-    batch_counter = 1
-
-    for group in groups:
-        batch_requests.append({
-            "id": str(batch_counter),
-            "method": "GET",
-            "url": f"/groups/{group['id']}/members"
-        })
-        batch_counter += 1
-
-        if len(batch_requests) == batch_size or group == groups[-1]:
-            batch_payload = {"requests": batch_requests}
-            response = req.post("https://graph.microsoft.com/v1.0/$batch", headers=headers, json=batch_payload)
-            response.raise_for_status()
-
-            results = response.json()["responses"]
-            for result in results:
-                idx = int(result["id"]) - 1
-                group_name = groups[idx]["displayName"]
-                if result["status"] == 200:
-                    members = [m["displayName"] for m in result["body"].get("value", [])]
-                    group_members[group_name] = members
-            batch_requests = []
+
+    # (group name, relative URL) for every member page still to be fetched; only displayName
+    # is kept, and 999 is the largest page Graph serves (default is 100)
+    pending = [
+        (group["displayName"], f"/groups/{group['id']}/members?$select=displayName&$top=999")
+        for group in groups
+    ]
+
+    # Batches are independent of each other, so each round is posted concurrently over the pooled session.
+    # Member lists longer than one page come back with a nextLink, which is queued into the next round.
+    with ThreadPoolExecutor(max_workers=MAX_BATCH_WORKERS) as executor:
+        while pending:
+            chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            # Sub-request ids are the position inside their own batch, so each response maps straight back to its chunk
+            batch_payloads = [
+                {"requests": [{"id": str(i), "method": "GET", "url": url} for i, (_, url) in enumerate(chunk)]}
+                for chunk in chunks
+            ]
+            pending = []
+
+            for chunk, results in zip(chunks, executor.map(lambda payload: post_batch(payload, headers), batch_payloads)):
+                for result in results:
+                    group_name = chunk[int(result["id"])][0]
+                    # A dropped page would show up as deleted groups or removed members, so fail the run instead
+                    if result["status"] != 200:
+                        raise Exception(f"Member fetch failed for '{group_name}' ({result['status']}): {result.get('body')}")
+                    body = result["body"]
+                    members = [m["displayName"] for m in body.get("value", [])]
+                    group_members.setdefault(group_name, []).extend(members)
+
+                    next_link = body.get("@odata.nextLink")
+                    if next_link:
+                        pending.append((group_name, next_link.replace("https://graph.microsoft.com/v1.0", "", 1)))
 
     return group_members
 
@@ -87,41 +174,54 @@ def save_current_snapshot(data):
         json.dump(data, f, indent=2)
 
 # ------------------ Comparison Logic ------------------
+def diff_sorted_members(cur, prev):
+    """Merge-walk two sorted member lists into sorted (added, removed, unchanged) lists."""
+    added, removed, unchanged = [], [], []
+    i = j = 0
+    while i < len(cur) and j < len(prev):
+        if cur[i] == prev[j]:
+            unchanged.append(cur[i])
+            i += 1
+            j += 1
+        elif cur[i] < prev[j]:
+            added.append(cur[i])
+            i += 1
+        else:
+            removed.append(prev[j])
+            j += 1
+    added += cur[i:]
+    removed += prev[j:]
+    return added, removed, unchanged
+
 def compare_snapshots(current, previous):
     result = {}
     all_keys = set(current.keys()).union(previous.keys())
     changes_detected = False
 
     for group in all_keys:
-        cur = set(current.get(group, []))
-        prev = set(previous.get(group, []))
-        added = list(cur - prev)
-        removed = list(prev - cur)
+        # Graph returns members in a stable order, so an identical list means nothing changed
+        if group in current and current[group] == previous.get(group):
+            result[group] = {'added': [], 'removed': [], 'unchanged': sorted(set(current[group]))}
+            continue
+
+        # Sort each side once; the merge walk then yields all three lists already sorted
+        cur = sorted(set(current.get(group, [])))
+        prev = sorted(set(previous.get(group, [])))
+        added, removed, unchanged = diff_sorted_members(cur, prev)
 
         if added or removed:
             changes_detected = True
         result[group] = {
-            'added': sorted(added),
-            'removed': sorted(removed),
-            'unchanged': sorted(cur & prev)
+            'added': added,
+            'removed': removed,
+            'unchanged': unchanged
         }
 
     return result, changes_detected
 #-------------------Generate Report----------
-def generate_html_report(snapshot, output_path):
-    html = [
-        "<html><head><style>",
-        "body { font-family: Arial, sans-serif; }",
-        "h2 { color: #333; }",
-        ".added { color: green; }",
-        ".removed { color: darkorange; }",
-        ".unchanged { color: black; }",
-        "table { border-collapse: collapse; width: 100%; }",
-        "th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }",
-        "</style></head><body>",
-        "<h1>Azure AD Group Membership Report</h1>"
-    ]
+REPORT_WRITE_BUFFER = 64 * 1024
 
+def generate_html_report(snapshot, output_path):
     # Separate changed and unchanged groups
     changed_groups = {}
     unchanged_groups = {}
@@ -131,37 +231,49 @@ def generate_html_report(snapshot, output_path):
         else:
             unchanged_groups[group] = data
 
-    def append_group_section(groups):
-        for group, data in groups:
-            html.append(f"<h2>{group}</h2>")
-            html.append("<table><tr><th>Change Type</th><th>Members</th></tr>")
-            for change_type in ["added", "removed", "unchanged"]:
-                class_name = change_type
-                for member in data.get(change_type, []):
-                    html.append(f"<tr><td class='{class_name}'>{change_type.capitalize()}</td><td class='{class_name}'>{member}</td></tr>")
-            html.append("</table><br>")
-
     # Sort group names alphabetically
     changed_sorted = sorted(changed_groups.items())
     unchanged_sorted = sorted(unchanged_groups.items())
 
-    # Display groups with changes first
-    html.append("<h1>Groups With Changes</h1>")
-    if changed_sorted:
-        append_group_section(changed_sorted)
-    else:
-        html.append("<p>No changes detected in any group.</p>")
-
-    # Then all groups sorted alphabetically
-    html.append("<h1>All Groups</h1>")
-    all_sorted_groups = changed_sorted + unchanged_sorted
-
-    append_group_section(sorted(all_sorted_groups))
+    # Lines go straight to the file instead of being collected in a list and joined
+    with open(output_path, 'w', encoding='utf-8', buffering=REPORT_WRITE_BUFFER) as f:
+        def write(line):
+            f.write(line)
+            f.write("\n")
+
+        write("<html><head><style>")
+        write("body { font-family: Arial, sans-serif; }")
+        write("h2 { color: #333; }")
+        write(".added { color: green; }")
+        write(".removed { color: darkorange; }")
+        write(".unchanged { color: black; }")
+        write("table { border-collapse: collapse; width: 100%; }")
+        write("th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }")
+        write("</style></head><body>")
+        write("<h1>Azure AD Group Membership Report</h1>")
+
+        def append_group_section(groups):
+            for group, data in groups:
+                write(f"<h2>{escape(group)}</h2>")
+                write("<table><tr><th>Change Type</th><th>Members</th></tr>")
+                for change_type in ["added", "removed", "unchanged"]:
+                    class_name = change_type
+                    for member in data.get(change_type, []):
+                        write(f"<tr><td class='{class_name}'>{change_type.capitalize()}</td><td class='{class_name}'>{escape(member)}</td></tr>")
+                write("</table><br>")
+
+        # Display groups with changes first
+        write("<h1>Groups With Changes</h1>")
+        if changed_sorted:
+            append_group_section(changed_sorted)
+        else:
+            write("<p>No changes detected in any group.</p>")
 
-    html.append("</body></html>")
+        # Then the remaining groups; changed groups were already rendered in full above
+        write("<h1>Groups Without Changes</h1>")
+        append_group_section(unchanged_sorted)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
+        write("</body></html>")
 
 #-------------------Generate PDF Report----------
 def generate_pdf_report(html_path, pdf_path):
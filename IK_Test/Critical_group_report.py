@@ -1,30 +1,35 @@
 import os
-import json
-import pdfkit
+import orjson
+from html import escape
 import base64
+import mmap
 import urllib.parse
 import unicodedata
 import re
+import time
+import random
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import requests as req
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from msal import ConfidentialClientApplication
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
 
 # --- Recipient helpers ---
-SEPARATORS = re.compile(r"[;, \n\r\t]+")
+# an address is any run of characters that is not a separator (';', ',' or whitespace)
+TOKEN_RE = re.compile(r"[^;,\s]+")
 
 def parse_recipients(value: str) -> list[str]:
     """Parse a string of email addresses into a list, handling various separators and de-duplicating."""
-    if not value:
-        return []
-    items = [x.strip() for x in SEPARATORS.split(value) if x.strip()]
-    # De-dup while keeping order
-    seen = set()
-    result = []
-    for x in items:
-        if x.lower() not in seen:
-            seen.add(x.lower())
-            result.append(x)
-    return result
+    # De-dup case-insensitively while keeping the first spelling and order
+    unique = {}
+    for x in TOKEN_RE.findall(value or ""):
+        unique.setdefault(x.lower(), x)
+    return list(unique.values())
 
 def to_recipient_objects(addresses: list[str]) -> list[dict]:
     """Convert emails to Graph recipient objects."""
@@ -34,28 +39,69 @@ def to_recipient_objects(addresses: list[str]) -> list[dict]:
 def clean_text(s: str) -> str:
     if not s:
         return ""
-    # strip BOM, trim, normalize accents to NFC
-    return unicodedata.normalize("NFC", s.lstrip("\ufeff").strip())
+    # strip BOM, trim, normalize accents to NFC (pure ASCII is already NFC, so skip it)
+    t = s.lstrip("\ufeff").strip()
+    return t if t.isascii() else unicodedata.normalize("NFC", t)
 
 def normalize_snapshot_keys(snap: dict) -> dict:
     """Normalize group names and member names inside a snapshot dict."""
-    fixed = {}
-    for k, v in (snap or {}).items():
-        nk = clean_text(k)
-        fixed[nk] = sorted({ clean_text(m) for m in (v or []) })
-    return fixed
+    # Builds a new dict and leaves the input untouched; keys that collide after cleaning keep the last one
+    return {
+        clean_text(k): sorted({ clean_text(m) for m in (v or []) })
+        for k, v in (snap or {}).items()
+    }
+# ------------------ HTTP Session ------------------
+# One pooled session so Graph calls reuse keep-alive connections instead of a new TLS handshake each time
+SESSION = req.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        # 429/503 throttling is handled by graph_request so POSTs are covered too
+        status_forcelist=[500, 502, 504],
+        raise_on_status=False,
+    ),
+))
+# Seconds to wait on Graph before giving up, so a stalled connection can't hang the pipeline
+GRAPH_TIMEOUT = 30
+MAX_THROTTLE_RETRIES = 5
+
+def graph_request(method, url, **kwargs):
+    """Send a Graph request, waiting out 429/503 throttling via Retry-After or jittered exponential backoff."""
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        response = SESSION.request(method, url, timeout=GRAPH_TIMEOUT, **kwargs)
+        if response.status_code not in (429, 503) or attempt == MAX_THROTTLE_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+        time.sleep(delay + random.uniform(0, 1))
+
 # ------------------ Authentication ------------------
-def get_token():
-    tenant_id = os.environ.get('TENANT_ID')
-    client_id = os.environ.get('CLIENT_ID')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    
-    if not all([tenant_id, client_id, client_secret]):
-        raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+_msal_app = None
+
+def get_msal_app():
+    # Build the MSAL client once so its in-memory token cache is shared across calls
+    global _msal_app
+    if _msal_app is None:
+        tenant_id = os.environ.get('TENANT_ID')
+        client_id = os.environ.get('CLIENT_ID')
+        client_secret = os.environ.get('CLIENT_SECRET')
+
+        if not all([tenant_id, client_id, client_secret]):
+            raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+
+        authority = f"https://login.microsoftonline.com/{tenant_id}"
+        _msal_app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
+    return _msal_app
 
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
-    token_result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+def get_token():
+    app = get_msal_app()
+    token_result = app.acquire_token_silent(GRAPH_SCOPES, account=None)
+    if not token_result:
+        token_result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
 
     if "access_token" in token_result:
         return token_result["access_token"]
@@ -76,50 +122,103 @@ def load_groups_from_csv(file_path):
 
 
 #---------------Get Group ids from names----------------
-def get_group_ids_from_names(group_names):
-    token = get_token()
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    group_ids = {}
+GRAPH_BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+# Graph accepts at most 20 sub-requests per $batch call
+BATCH_SIZE = 20
+# Graph caps the number of values in a `displayName in (...)` filter, and long filters hit URL limits
+NAME_FILTER_CHUNK = 15
+MAX_BATCH_ATTEMPTS = 5
+
+def post_batch(sub_requests, headers):
+    """POST sub-requests to Graph $batch and return {id: response}, re-sending any that come back throttled."""
+    responses = {}
+    pending = sub_requests
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+        response = graph_request("POST", GRAPH_BATCH_URL, headers=headers, json={"requests": pending})
+        response.raise_for_status()
 
-    for name in group_names:
+        throttled = set()
+        retry_after = 1
+        for result in orjson.loads(response.content)["responses"]:
+            if result["status"] == 429 and attempt < MAX_BATCH_ATTEMPTS:
+                throttled.add(result["id"])
+                retry_after = max(retry_after, int(result.get("headers", {}).get("Retry-After", 1)))
+            else:
+                responses[result["id"]] = result
+
+        if not throttled:
+            break
+        time.sleep(retry_after)
+        pending = [r for r in pending if r["id"] in throttled]
+    return responses
+
+def lookup_group_ids(group_names, headers):
+    """Resolve names with filtered lookups and return {casefolded displayName: id}."""
+    # One `displayName in (...)` lookup per chunk of names, sent 20 lookups per $batch call
+    name_chunks = [group_names[i:i + NAME_FILTER_CHUNK] for i in range(0, len(group_names), NAME_FILTER_CHUNK)]
+    sub_requests = []
+    for i, chunk in enumerate(name_chunks):
         # Escape single quotes for Graph filter syntax
-        escaped_name = name.replace("'", "''")
+        quoted = ",".join("'" + name.replace("'", "''") + "'" for name in chunk)
 
         # URL encode only the filter value, not the whole query string
-        filter_query = f"displayName eq '{escaped_name}'"
-        encoded_query = urllib.parse.quote(filter_query, safe="=$'()")
-
-        url = f"https://graph.microsoft.com/v1.0/groups?$filter={encoded_query}"
-        response = req.get(url, headers=headers)
-        response.raise_for_status()
+        filter_query = f"displayName in ({quoted})"
+        encoded_query = urllib.parse.quote(filter_query, safe="=$'(),")
+
+        sub_requests.append({
+            "id": str(i),
+            "method": "GET",
+            "url": f"/groups?$filter={encoded_query}&$select=id,displayName",
+        })
+
+    # Graph matches displayName case-insensitively, so map results back the same way
+    found = {}
+    for start in range(0, len(sub_requests), BATCH_SIZE):
+        results = post_batch(sub_requests[start:start + BATCH_SIZE], headers)
+        for result in results.values():
+            if result["status"] != 200:
+                raise Exception(f"Group lookup failed ({result['status']}): {result.get('body')}")
+            for g in result["body"].get("value", []):
+                found.setdefault(clean_text(g.get("displayName")).casefold(), g["id"])
+    return found
+
+def get_group_ids_from_names(group_names, headers):
+    # Filtered lookups resolve 300 names per $batch call, far fewer requests than paging every group
+    found = lookup_group_ids(group_names, headers)
 
-        data = response.json().get("value", [])
-        if data:
-            group_ids[name] = data[0]["id"]
+    group_ids = {}
+    for name in group_names:
+        gid = found.get(name.casefold())
+        if gid:
+            group_ids[name] = gid
         else:
             print(f"[WARN] No match found for group '{name}'")
 
     return group_ids
 
 
-# ------------- Fetch members for ONE group (handles paging) -------------
-def fetch_group_members(group_id, headers):
-    # Pull members with paging; keep displayName normalized
-    url = f"https://graph.microsoft.com/v1.0/groups/{group_id}/members?$select=id,displayName,userPrincipalName&$top=999"
+# ------------- Fetch group members (handles paging) -------------
+# only displayName (or id as fallback) is kept, so fetch nothing else per member
+MEMBERS_QUERY = "$select=id,displayName&$top=999"
+
+def collect_members(page):
+    # keep displayName normalized; fall back to id for objects without one
+    return [clean_text(m.get("displayName") or m.get("id")) for m in page.get("value", [])]
+
+def fetch_member_pages(url, headers):
+    # Pull the remaining member pages of one group, starting from a nextLink
     members = []
     while url:
-        r = req.get(url, headers=headers)
+        r = graph_request("GET", url, headers=headers)
         r.raise_for_status()
-        j = r.json()
-        for m in j.get("value", []):
-            dn = clean_text(m.get("displayName") or m.get("id"))
-            members.append(dn)
+        j = orjson.loads(r.content)
+        members.extend(collect_members(j))
         url = j.get("@odata.nextLink")
     return members
 
+# Member fetches are pure network waits; more than ~8 in flight gives diminishing returns against Graph
+MAX_FETCH_WORKERS = 8
+
 def get_all_group_members():
     token = get_token()
     headers = {
@@ -131,20 +230,41 @@ def get_all_group_members():
     group_names = load_groups_from_csv('inputs/critical_groups.csv')
 
     # 2) resolve names -> IDs (uses your safe resolver)
-    name_to_id = get_group_ids_from_names(group_names)
+    name_to_id = get_group_ids_from_names(group_names, headers)
 
     print(f"Total groups in input: {len(group_names)}")
     print(f"Resolved IDs: {len(name_to_id)}")
 
-    # 3) fetch and normalize
+    # 3) fetch and normalize (unresolved names were already reported by the resolver).
+    # First pages go out 20 groups per $batch call, with batches posted concurrently;
+    # only groups larger than one page need follow-up requests, which run on the same pool.
+    items = list(name_to_id.items())
+    sub_requests = [
+        {"id": str(i), "method": "GET", "url": f"/groups/{gid}/members?{MEMBERS_QUERY}"}
+        for i, (_, gid) in enumerate(items)
+    ]
+    batches = [sub_requests[i:i + BATCH_SIZE] for i in range(0, len(sub_requests), BATCH_SIZE)]
+
+    first_pages = {}
+    follow_ups = {}
     group_members = {}
-    for name in group_names:
-        gid = name_to_id.get(name)
-        if not gid:
-            print(f"[WARN] Skipping '{name}' – no GroupId resolved.")
-            continue
-        members = fetch_group_members(gid, headers)
-        group_members[clean_text(name)] = sorted(set(clean_text(x) for x in members))
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        for results in executor.map(lambda batch: post_batch(batch, headers), batches):
+            for request_id, result in results.items():
+                name = items[int(request_id)][0]
+                if result["status"] != 200:
+                    raise Exception(f"Member fetch failed for '{name}' ({result['status']}): {result.get('body')}")
+                first_pages[name] = collect_members(result["body"])
+                next_link = result["body"].get("@odata.nextLink")
+                if next_link:
+                    follow_ups[name] = executor.submit(fetch_member_pages, next_link, headers)
+
+        for name, _ in items:
+            members = first_pages[name]
+            if name in follow_ups:
+                members += follow_ups[name].result()
+            # collect_members already normalized every entry, so just dedup and sort
+            group_members[clean_text(name)] = sorted(dict.fromkeys(members))
 
     return group_members
 
@@ -158,22 +278,40 @@ def load_previous_snapshot():
         "previous_snapshot.json",
     )
     if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(path, 'rb') as f:
+            data = orjson.loads(f.read())
         return normalize_snapshot_keys(data)
     print("No previous snapshot found, treating this as first run.")
     return {}
 
 
-def save_current_snapshot(data):
-    artifacts_dir = os.environ.get('BUILD_ARTIFACTSTAGINGDIRECTORY', './pipeline-artifacts')
-    os.makedirs(artifacts_dir, exist_ok=True)
-    # normalize before save; ensure_ascii=False keeps accented chars as-is
+def save_current_snapshot(data, artifacts_dir):
+    # normalize before save; orjson writes UTF-8 so accented chars stay as-is.
+    # Only read back by the next run, so it is written compact
     norm = normalize_snapshot_keys(data)
-    with open(os.path.join(artifacts_dir, 'previous_snapshot.json'), 'w', encoding='utf-8') as f:
-        json.dump(norm, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(artifacts_dir, 'previous_snapshot.json'), 'wb') as f:
+        f.write(orjson.dumps(norm))
 
 # ------------------ Comparison Logic ------------------
+def diff_sorted_members(cur, prev):
+    """Merge-walk two sorted member lists into sorted (added, removed, unchanged) lists."""
+    added, removed, unchanged = [], [], []
+    i = j = 0
+    while i < len(cur) and j < len(prev):
+        if cur[i] == prev[j]:
+            unchanged.append(cur[i])
+            i += 1
+            j += 1
+        elif cur[i] < prev[j]:
+            added.append(cur[i])
+            i += 1
+        else:
+            removed.append(prev[j])
+            j += 1
+    added += cur[i:]
+    removed += prev[j:]
+    return added, removed, unchanged
+
 def compare_snapshots(current, previous):
     result = {}
     added_groups = []
@@ -181,15 +319,13 @@ def compare_snapshots(current, previous):
     all_keys = set(current.keys()).union(previous.keys())
     changes_detected = False
 
+    # Snapshots hold sorted member lists, so no per-group sets or re-sorting are needed
     for group in all_keys:
-        cur_members = set(current.get(group, []))
-        prev_members = set(previous.get(group, []))
-
         # Check if group is added
         if group not in previous:
             added_groups.append(group)
             result[group] = {
-                'added': sorted(current[group]),
+                'added': list(current[group]),
                 'removed': [],
                 'unchanged': []
             }
@@ -200,104 +336,196 @@ def compare_snapshots(current, previous):
             deleted_groups.append(group)
             result[group] = {   
                 'added': [],
-                'removed': sorted(previous[group]),
+                'removed': list(previous[group]),
                 'unchanged': []
             }
             changes_detected = True
 
+        # Most groups don't change between runs; identical sorted lists need no diff at all
+        elif current[group] == previous[group]:
+            result[group] = {
+                'added': [],
+                'removed': [],
+                'unchanged': current[group]
+            }
+
         # Check if group has changes
         else:
-            added = list(cur_members - prev_members)
-            removed = list(prev_members - cur_members)
-            unchanged = list(cur_members & prev_members)
+            added, removed, unchanged = diff_sorted_members(current[group], previous[group])
 
             if added or removed:
                 changes_detected = True
             result[group] = {
-                'added': sorted(added),
-                'removed': sorted(removed),
-                'unchanged': sorted(cur_members & prev_members)
+                'added': added,
+                'removed': removed,
+                'unchanged': unchanged
             }
     return result, changes_detected, added_groups, deleted_groups
 
 #-------------------Generate Report----------
-def generate_html_report(snapshot, output_path, added_groups, deleted_groups):
-    html = [
-        "<html><head><meta charset='UTF-8'><style>",
-        "body { font-family: Segoe UI, Arial, Helvetica Neue, sans-serif; }",
-        "h2 { color: #333; }",
-        ".added { color: green; }",
-        ".removed { color: darkorange; }",
-        ".unchanged { color: black; }",
-        "table { border-collapse: collapse; width: 100%; }",
-        "th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }",
-        "</style></head><body>",
-        "<h1>Critical Group Membership Report</h1>",
-        f"<p>Report generated on: <strong>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</strong></p><br>"
-        "<p>Total Groups Analyzed: " + str(len(snapshot)) + "</p><br>"
-    ]
-
-    # Add added and deleted groups
-    if added_groups:
-        html.append("<h2>Added Groups</h2>")
-        for group in added_groups:
-            html.append(f"<p>{group}</p>")
-        html.append("<br>")
-
-    if deleted_groups:
-        html.append("<h2>Deleted Groups</h2>")
-        for group in deleted_groups:
-            html.append(f"<p>{group}</p>")
-        html.append("<br>")
-
-    # Separate changed and unchanged groups
-    changed_groups = {}
-    unchanged_groups = {}
-    for group, data in snapshot.items():
+REPORT_WRITE_BUFFER = 64 * 1024
+CHANGE_LABELS = {"added": "Added", "removed": "Removed", "unchanged": "Unchanged"}
+
+def split_changed_groups(snapshot):
+    # Sort group names alphabetically once, then split into changed and unchanged
+    changed_sorted = []
+    unchanged_sorted = []
+    for group, data in sorted(snapshot.items()):
         if data["added"] or data["removed"]:
-            changed_groups[group] = data
+            changed_sorted.append((group, data))
         else:
-            unchanged_groups[group] = data
+            unchanged_sorted.append((group, data))
+    return changed_sorted, unchanged_sorted
+
+def generate_html_report(snapshot, output_path, added_groups, deleted_groups, generated_at):
+    changed_sorted, unchanged_sorted = split_changed_groups(snapshot)
+
+    # Rows are written straight to the file as they are produced instead of
+    # collecting the whole document in a list and joining it at the end
+    with open(output_path, 'w', encoding='utf-8', buffering=REPORT_WRITE_BUFFER) as f:
+        def write(line):
+            f.write(line)
+            f.write("\n")
+
+        write("<html><head><meta charset='UTF-8'><style>")
+        write("body { font-family: Segoe UI, Arial, Helvetica Neue, sans-serif; }")
+        write("h2 { color: #333; }")
+        write(".added { color: green; }")
+        write(".removed { color: darkorange; }")
+        write(".unchanged { color: black; }")
+        write("table { border-collapse: collapse; width: 100%; }")
+        write("th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }")
+        write("</style></head><body>")
+        write("<h1>Critical Group Membership Report</h1>")
+        write(f"<p>Report generated on: <strong>{generated_at.strftime('%Y-%m-%d %H:%M:%S')}</strong></p><br>"
+              "<p>Total Groups Analyzed: " + str(len(snapshot)) + "</p><br>")
+
+        # Add added and deleted groups
+        if added_groups:
+            write("<h2>Added Groups</h2>")
+            for group in added_groups:
+                write(f"<p>{escape(group)}</p>")
+            write("<br>")
+
+        if deleted_groups:
+            write("<h2>Deleted Groups</h2>")
+            for group in deleted_groups:
+                write(f"<p>{escape(group)}</p>")
+            write("<br>")
+
+        def append_group_section(groups):
+            for group, data in groups:
+                write(f"<h2>{escape(group)}</h2>")
+                write("<table><tr><th>Change Type</th><th>Members</th></tr>")
+                for change_type, label in CHANGE_LABELS.items():
+                    members = data.get(change_type, ())
+                    if members:
+                        # Rows go to the buffered file one by one; no per-section string is built
+                        cell = f"<tr><td class='{change_type}'>{label}</td><td class='{change_type}'>"
+                        f.writelines(f"{cell}{escape(member)}</td></tr>\n" for member in members)
+                write("</table><br>")
+
+        # Display groups with changes first
+        write("<h1>Groups With Changes</h1>")
+        if changed_sorted:
+            append_group_section(changed_sorted)
+        else:
+            write("<p>No changes detected in any group.</p>")
+
+        # Then the remaining groups; changed groups were already rendered in full above
+        write("<h1>Groups Without Changes</h1>")
+        append_group_section(unchanged_sorted)
+
+        write("</body></html>")
+
+#-------------------Generate PDF Report----------
+PDF_CHANGE_COLORS = {"added": colors.green, "removed": colors.darkorange, "unchanged": colors.black}
+
+def generate_pdf_report(snapshot, pdf_path, added_groups, deleted_groups, generated_at):
+    # Build the PDF in-process with ReportLab from the snapshot itself,
+    # rather than shelling out to wkhtmltopdf to re-render the HTML file
+    changed_sorted, unchanged_sorted = split_changed_groups(snapshot)
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph("Critical Group Membership Report", styles['Title']),
+        Paragraph(f"Report generated on: <b>{generated_at.strftime('%Y-%m-%d %H:%M:%S')}</b>", styles['Normal']),
+        Paragraph(f"Total Groups Analyzed: {len(snapshot)}", styles['Normal']),
+        Spacer(1, 12),
+    ]
+
+    for title, groups in (("Added Groups", added_groups), ("Deleted Groups", deleted_groups)):
+        if groups:
+            story.append(Paragraph(title, styles['Heading2']))
+            for group in groups:
+                story.append(Paragraph(escape(group), styles['Normal']))
+            story.append(Spacer(1, 12))
 
     def append_group_section(groups):
         for group, data in groups:
-            html.append(f"<h2>{group}</h2>")
-            html.append("<table><tr><th>Change Type</th><th>Members</th></tr>")
-            for change_type in ["added", "removed", "unchanged"]:
-                class_name = change_type
-                for member in data.get(change_type, []):
-                    html.append(f"<tr><td class='{class_name}'>{change_type.capitalize()}</td><td class='{class_name}'>{member}</td></tr>")
-            html.append("</table><br>")
-
-    # Sort group names alphabetically
-    changed_sorted = sorted(changed_groups.items())
-    unchanged_sorted = sorted(unchanged_groups.items())
-
-    # Display groups with changes first
-    html.append("<h1>Groups With Changes</h1>")
+            story.append(Paragraph(escape(group), styles['Heading2']))
+            rows = [["Change Type", "Members"]]
+            table_style = [
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ]
+            for change_type, label in CHANGE_LABELS.items():
+                members = data.get(change_type, ())
+                if members:
+                    first_row = len(rows)
+                    rows.extend([label, member] for member in members)
+                    table_style.append(('TEXTCOLOR', (0, first_row), (-1, len(rows) - 1), PDF_CHANGE_COLORS[change_type]))
+            # LongTable splits big groups across pages without laying out the whole table at once
+            story.append(LongTable(rows, repeatRows=1, hAlign='LEFT', style=TableStyle(table_style)))
+            story.append(Spacer(1, 12))
+
+    story.append(Paragraph("Groups With Changes", styles['Heading1']))
     if changed_sorted:
         append_group_section(changed_sorted)
     else:
-        html.append("<p>No changes detected in any group.</p>")
-
-    # Then all groups sorted alphabetically
-    html.append("<h1>All Groups</h1>")
-    all_sorted_groups = changed_sorted + unchanged_sorted
-
-    append_group_section(sorted(all_sorted_groups))
+        story.append(Paragraph("No changes detected in any group.", styles['Normal']))
 
-    html.append("</body></html>")
+    story.append(Paragraph("Groups Without Changes", styles['Heading1']))
+    append_group_section(unchanged_sorted)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
-
-#-------------------Generate PDF Report----------
-def generate_pdf_report(html_path, pdf_path):
-    pdfkit.from_file(html_path, pdf_path, options={'encoding': "UTF-8"})
+    SimpleDocTemplate(pdf_path, pagesize=A4).build(story)
     print(f"PDF report saved to: {pdf_path}")
    
 #------------------Email report----------
-def send_email(html_path, pdf_path):
+# Graph only accepts file attachments under 3 MB inline; bigger ones go through an upload session
+INLINE_ATTACHMENT_LIMIT = 3 * 1024 * 1024
+# Upload session chunks must be a multiple of 320 KiB
+UPLOAD_CHUNK_SIZE = 320 * 1024
+
+def encode_attachment(pdf_path):
+    # Encode straight from a read-only memory map instead of first copying the file into a bytes object
+    with open(pdf_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return base64.b64encode(mm).decode('ascii')
+
+def upload_large_attachment(mailbox_url, message_id, pdf_path, name, headers):
+    size = os.path.getsize(pdf_path)
+    response = graph_request(
+        "POST",
+        f"{mailbox_url}/messages/{message_id}/attachments/createUploadSession",
+        headers=headers,
+        json={"AttachmentItem": {"attachmentType": "file", "name": name, "size": size}},
+    )
+    response.raise_for_status()
+    upload_url = response.json()["uploadUrl"]
+
+    # The upload URL is pre-authenticated, so no Authorization header is sent with the chunks
+    with open(pdf_path, 'rb') as f:
+        start = 0
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            end = start + len(chunk) - 1
+            chunk_headers = {
+                "Content-Type": "application/octet-stream",
+                "Content-Range": f"bytes {start}-{end}/{size}",
+            }
+            SESSION.put(upload_url, headers=chunk_headers, data=chunk, timeout=GRAPH_TIMEOUT).raise_for_status()
+            start = end + 1
+
+def send_email(pdf_path):
     SENDER_EMAIL = os.environ.get('SENDER_EMAIL')
     RECIPIENT_EMAIL = os.environ.get('RECIPIENT_EMAIL')
 
@@ -310,16 +538,11 @@ def send_email(html_path, pdf_path):
     token = get_token()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
-    # Use /users/{sender}/sendMail if SENDER_EMAIL is set, otherwise /me/sendMail
+    # Use /users/{sender} if SENDER_EMAIL is set, otherwise /me
     if SENDER_EMAIL:
-        url = f"https://graph.microsoft.com/v1.0/users/{SENDER_EMAIL}/sendMail"
+        mailbox_url = f"https://graph.microsoft.com/v1.0/users/{SENDER_EMAIL}"
     else:
-        url = "https://graph.microsoft.com/v1.0/me/sendMail"
-
-    with open(html_path, 'r', encoding='utf-8') as f:
-        html_content = f.read()
-    with open(pdf_path, 'rb') as f:
-        pdf_content = f.read()
+        mailbox_url = "https://graph.microsoft.com/v1.0/me"
 
     # Add your custom message at the top of the email body
     custom_message = """
@@ -330,24 +553,33 @@ def send_email(html_path, pdf_path):
     """
     full_html_body = custom_message 
 
-    email_payload = {
-        "message": {
-            "subject": "Report: Critical Group Membership changes",
-            "body": {
-                "contentType": "HTML",
-                "content": full_html_body
-            },
-            "toRecipients": to_recipient_objects(to_list),
-            "attachments": [{
-                "@odata.type": "#microsoft.graph.fileAttachment",
-                "name": "Critical_groups_membership_report.pdf",
-                "contentBytes": base64.b64encode(pdf_content).decode('utf-8')
-            }]
+    message = {
+        "subject": "Report: Critical Group Membership changes",
+        "body": {
+            "contentType": "HTML",
+            "content": full_html_body
         },
-        "saveToSentItems": "true"
+        "toRecipients": to_recipient_objects(to_list),
     }
+    attachment_name = "Critical_groups_membership_report.pdf"
+
+    if os.path.getsize(pdf_path) < INLINE_ATTACHMENT_LIMIT:
+        message["attachments"] = [{
+            "@odata.type": "#microsoft.graph.fileAttachment",
+            "name": attachment_name,
+            "contentBytes": encode_attachment(pdf_path)
+        }]
+        email_payload = {"message": message, "saveToSentItems": "true"}
+        # orjson serializes the base64 string in one pass; requests' json= would run it through the stdlib encoder
+        response = graph_request("POST", f"{mailbox_url}/sendMail", headers=headers, data=orjson.dumps(email_payload))
+    else:
+        # Create a draft, stream the PDF into it in chunks, then send the draft
+        draft = graph_request("POST", f"{mailbox_url}/messages", headers=headers, json=message)
+        draft.raise_for_status()
+        message_id = draft.json()["id"]
+        upload_large_attachment(mailbox_url, message_id, pdf_path, attachment_name, headers)
+        response = graph_request("POST", f"{mailbox_url}/messages/{message_id}/send", headers=headers)
 
-    response = req.post(url, headers=headers, json=email_payload)
     try:
         response.raise_for_status()
         print("Email sent successfully")
@@ -358,6 +590,9 @@ def send_email(html_path, pdf_path):
 # ------------------ Entry ------------------
 def main():
     print(" Starting group snapshot comparison...")
+    # one clock read per run, shared by the report body and both file names
+    run_started = datetime.now()
+    TS = run_started.strftime('%Y-%m-%d_%H-%M-%S')
 
     artifacts_dir = os.environ.get('BUILD_ARTIFACTSTAGINGDIRECTORY', './pipeline-artifacts')
     os.makedirs(artifacts_dir, exist_ok=True)
@@ -368,29 +603,29 @@ def main():
     if not previous:
         print("No previous snapshot found. This is likely the first run.")
         print("Saving current snapshot for future comparison.")
-        save_current_snapshot(current)
+        save_current_snapshot(current, artifacts_dir)
         return
 
     snapshot, changes_detected, added_groups, deleted_groups = compare_snapshots(current, previous)
-    save_current_snapshot(current)
+    save_current_snapshot(current, artifacts_dir)
 
     print("Snapshot comparison complete.")
 
     # Save comparison result
-    with open(os.path.join(artifacts_dir, 'comparison_result.json'), 'w', encoding='utf-8') as f:
-        json.dump(snapshot, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(artifacts_dir, 'comparison_result.json'), 'wb') as f:
+        f.write(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2))
 
     # Generate HTML report
-    html_report_path = os.path.join(artifacts_dir, 'Critical_groups_membership_report{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.html')
-    generate_html_report(snapshot, html_report_path, added_groups, deleted_groups)
+    html_report_path = os.path.join(artifacts_dir, f'Critical_groups_membership_report_{TS}.html')
+    generate_html_report(snapshot, html_report_path, added_groups, deleted_groups, run_started)
     print(f"HTML report saved to: {html_report_path}")
 
     # Generate PDF report
-    pdf_report_path = os.path.join(artifacts_dir, 'Critical_groups_membership_report{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.pdf')
-    generate_pdf_report(html_report_path, pdf_report_path)
+    pdf_report_path = os.path.join(artifacts_dir, f'Critical_groups_membership_report_{TS}.pdf')
+    generate_pdf_report(snapshot, pdf_report_path, added_groups, deleted_groups, run_started)
     
     # Send email
-    send_email(html_report_path, pdf_report_path)
+    send_email(pdf_report_path)
 
 if __name__ == "__main__":
     main()
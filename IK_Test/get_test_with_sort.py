@@ -2,24 +2,38 @@ import os
 import json
 import pdfkit
 import base64
+import mmap
 from datetime import datetime
 import requests as req
+from html import escape
 from msal import ConfidentialClientApplication
 
 # ------------------ Auth ------------------
 filter_query = os.environ.get('GROUPS_FILTER')
 
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+_msal_app    = None
+
+def get_msal_app():
+    """Build the MSAL client once so its in-memory token cache is shared across calls."""
+    global _msal_app
+    if _msal_app is None:
+        tenant_id     = os.environ.get('TENANT_ID')
+        client_id     = os.environ.get('CLIENT_ID')
+        client_secret = os.environ.get('CLIENT_SECRET')
+        if not all([tenant_id, client_id, client_secret]):
+            raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+        _msal_app = ConfidentialClientApplication(
+            client_id, client_secret,
+            authority=f"https://login.microsoftonline.com/{tenant_id}"
+        )
+    return _msal_app
+
 def get_token():
-    tenant_id     = os.environ.get('TENANT_ID')
-    client_id     = os.environ.get('CLIENT_ID')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    if not all([tenant_id, client_id, client_secret]):
-        raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
-    app = ConfidentialClientApplication(
-        client_id, client_secret,
-        authority=f"https://login.microsoftonline.com/{tenant_id}"
-    )
-    result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+    app    = get_msal_app()
+    result = app.acquire_token_silent(GRAPH_SCOPES, account=None)
+    if not result:
+        result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
     if "access_token" in result:
         return result["access_token"]
     raise Exception(f"Token error: {result.get('error_description')}")
@@ -176,13 +190,13 @@ def generate_html_report(snapshot, output_path, added_groups, deleted_groups):
     if added_groups:
         html.append("<h2>Added Groups</h2>")
         for g in added_groups:
-            html.append(f"<p>{g}</p>")
+            html.append(f"<p>{escape(g)}</p>")
         html.append("<br>")
 
     if deleted_groups:
         html.append("<h2>Deleted Groups</h2>")
         for g in deleted_groups:
-            html.append(f"<p>{g}</p>")
+            html.append(f"<p>{escape(g)}</p>")
         html.append("<br>")
 
     changed   = sorted((g, d) for g, d in snapshot.items() if d["added"] or d["removed"])
@@ -190,14 +204,14 @@ def generate_html_report(snapshot, output_path, added_groups, deleted_groups):
 
     def append_section(groups):
         for group, data in groups:
-            html.append(f"<h2>{group}</h2>")
+            html.append(f"<h2>{escape(group)}</h2>")
             html.append("<table><tr><th>Change Type</th><th>Members</th></tr>")
             for change_type in ["added", "removed", "unchanged"]:
                 for member in data.get(change_type, []):
                     cls = change_type
                     html.append(
                         f"<tr><td class='{cls}'>{change_type.capitalize()}</td>"
-                        f"<td class='{cls}'>{member}</td></tr>"
+                        f"<td class='{cls}'>{escape(member)}</td></tr>"
                     )
             html.append("</table><br>")
 
@@ -233,8 +247,9 @@ def send_email(pdf_path):
         "https://graph.microsoft.com/v1.0/me/sendMail"
     )
 
-    with open(pdf_path, 'rb') as f:
-        pdf_b64 = base64.b64encode(f.read()).decode('utf-8')
+    # Encode straight from a read-only memory map instead of first copying the file into a bytes object
+    with open(pdf_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pdf_b64 = base64.b64encode(mm).decode('ascii')
 
     payload = {
         "message": {
@@ -8,54 +8,59 @@ This script:
 3. Generates a PDF report highlighting changes (new members in green, removed in amber)
 
 Prerequisites:
-- pip install azure-identity msal requests reportlab
+- pip install azure-identity msal requests reportlab orjson
 - Azure app registration with appropriate permissions
 - Group.Read.All permission in Azure AD
 """
 
-import json
 import os
 import datetime
 import sys
-from typing import Dict, List, Set, Tuple
+import time
+import random
+from typing import Dict, Iterator, List, Tuple
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from azure.identity import ClientSecretCredential
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
 
-@dataclass
+@dataclass(slots=True)
 class GroupMember:
-    """Represents a group member with essential information"""
+    """Represents a group member with essential information (slotted: no per-instance __dict__)"""
     id: str
     display_name: str
     user_principal_name: str
     mail: str = None
     
-    def to_dict(self) -> Dict:
-        return {
-            'id': self.id,
-            'display_name': self.display_name,
-            'user_principal_name': self.user_principal_name,
-            'mail': self.mail
-        }
-    
     @classmethod
     def from_dict(cls, data: Dict) -> 'GroupMember':
+        # Ids are interned so a member loaded here and the same member fetched from Graph
+        # share one string object, letting the compare's set lookups match on identity
         return cls(
-            id=data['id'],
+            id=sys.intern(data['id']),
             display_name=data['display_name'],
             user_principal_name=data['user_principal_name'],
             mail=data.get('mail')
         )
 
 
+# Properties requested per member; @odata.type is always returned for directory objects
+MEMBER_SELECT = "id,displayName,userPrincipalName,mail"
+# How many times a throttled (429/503) Graph call is retried before giving up
+MAX_THROTTLE_RETRIES = 5
+
+
 class EntraGroupManager:
     """Manages Azure Entra ID group operations"""
     
@@ -65,73 +70,124 @@ class EntraGroupManager:
         self.client_secret = client_secret
         self.credential = ClientSecretCredential(tenant_id, client_id, client_secret)
         self.graph_url = "https://graph.microsoft.com/v1.0"
+        self._token = None
+        self._token_expires_on = 0
+        
+        # Pooled session so every page reuses the same keep-alive connection instead of a new TLS handshake
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=20,
+            # 429/503 throttling is handled by _request_with_retry using Retry-After
+            max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 504], raise_on_status=False)
+        ))
         
     def get_access_token(self) -> str:
-        """Get access token for Microsoft Graph API"""
-        token = self.credential.get_token("https://graph.microsoft.com/.default")
-        return token.token
+        """Get access token for Microsoft Graph API, reusing it until shortly before expiry"""
+        if self._token is None or time.time() >= self._token_expires_on - 60:
+            token = self.credential.get_token("https://graph.microsoft.com/.default")
+            self._token = token.token
+            self._token_expires_on = token.expires_on
+            # Installed on the session once per refresh instead of building headers per request
+            self.session.headers['Authorization'] = f'Bearer {self._token}'
+        return self._token
     
-    def get_group_members(self, group_id: str) -> List[GroupMember]:
-        """Fetch current group members from Azure Entra ID"""
-        headers = {
-            'Authorization': f'Bearer {self.get_access_token()}',
-            'Content-Type': 'application/json'
-        }
-        
-        members = []
-        url = f"{self.graph_url}/groups/{group_id}/members"
+    def _request_with_retry(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a Graph request, waiting out 429/503 throttling via Retry-After or jittered exponential backoff"""
+        self.get_access_token()
+        token_refreshed = False
+        attempt = 0
+        while True:
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code == 401 and not token_refreshed:
+                # Token was revoked or expired early: drop it, fetch a new one and resend once.
+                # The resend doesn't count against the throttle retries
+                self._token = None
+                self.get_access_token()
+                token_refreshed = True
+                continue
+            if response.status_code not in (429, 503) or attempt == MAX_THROTTLE_RETRIES:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+            time.sleep(delay + random.uniform(0, 1))
+            attempt += 1
+    
+    def iter_group_members(self, group_id: str) -> Iterator[GroupMember]:
+        """Yield current user members of a group from Azure Entra ID, page by page"""
+        # Graph pages through members with opaque skip tokens, so pages can't be fetched
+        # in parallel; ask for the largest page size and only the fields we keep instead
+        url = f"{self.graph_url}/groups/{group_id}/members?$select={MEMBER_SELECT}&$top=999"
         
         while url:
-            response = requests.get(url, headers=headers)
+            response = self._request_with_retry('GET', url)
             response.raise_for_status()
             
-            data = response.json()
+            # orjson parses the (up to 999-member) page much faster than the stdlib json behind response.json()
+            data = orjson.loads(response.content)
             
             for member in data.get('value', []):
                 if member.get('@odata.type') == '#microsoft.graph.user':
-                    members.append(GroupMember(
-                        id=member['id'],
+                    yield GroupMember(
+                        id=sys.intern(member['id']),
                         display_name=member.get('displayName', ''),
                         user_principal_name=member.get('userPrincipalName', ''),
                         mail=member.get('mail')
-                    ))
+                    )
             
             url = data.get('@odata.nextLink')
-        
-        return members
-
-
-class MembershipComparator:
-    """Compares group memberships and identifies changes"""
     
-    @staticmethod
-    def compare_memberships(
-        current_members: List[GroupMember], 
-        previous_members: List[GroupMember]
+    def fetch_and_classify(
+        self,
+        group_id: str,
+        prev_by_id: Dict[str, GroupMember]
     ) -> Tuple[List[GroupMember], List[GroupMember], List[GroupMember]]:
         """
-        Compare current and previous member lists
+        Fetch group members and classify them against the previous members as pages arrive
+        
+        prev_by_id is consumed: every previous member seen in Graph is popped from it,
+        so whatever remains afterwards has been removed from the group.
         
         Returns:
             Tuple of (new_members, removed_members, unchanged_members)
         """
-        current_ids = {member.id for member in current_members}
-        previous_ids = {member.id for member in previous_members}
-        
-        # Create lookup dictionaries
-        current_dict = {member.id: member for member in current_members}
-        previous_dict = {member.id: member for member in previous_members}
-        
-        # Find changes
-        new_member_ids = current_ids - previous_ids
-        removed_member_ids = previous_ids - current_ids
-        unchanged_member_ids = current_ids & previous_ids
-        
-        new_members = [current_dict[id] for id in new_member_ids]
-        removed_members = [previous_dict[id] for id in removed_member_ids]
-        unchanged_members = [current_dict[id] for id in unchanged_member_ids]
+        new_members = []
+        unchanged_members = []
+        for member in self.iter_group_members(group_id):
+            if prev_by_id.pop(member.id, None) is None:
+                new_members.append(member)
+            else:
+                unchanged_members.append(member)
         
-        return new_members, removed_members, unchanged_members
+        return new_members, list(prev_by_id.values()), unchanged_members
+
+
+# Shared by every member table; only the header/body background colors differ per section
+MEMBER_TABLE_HEADER = ['Display Name', 'User Principal Name', 'Email']
+MEMBER_TABLE_COL_WIDTHS = [2*inch, 2.5*inch, 2*inch]
+MEMBER_TABLE_STYLE = [
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+]
+
+
+def member_table(members: List[GroupMember], header_color, body_color, *extra_style) -> LongTable:
+    """Build a member table with one row per member, styled with the section colors"""
+    rows = [MEMBER_TABLE_HEADER]
+    rows += [[m.display_name, m.user_principal_name, m.mail or 'N/A'] for m in members]
+    # LongTable lays out large groups page by page and repeats the header on each page
+    table = LongTable(rows, colWidths=MEMBER_TABLE_COL_WIDTHS, repeatRows=1)
+    table.setStyle(TableStyle(MEMBER_TABLE_STYLE + [
+        ('BACKGROUND', (0, 0), (-1, 0), header_color),
+        ('BACKGROUND', (0, 1), (-1, -1), body_color),
+        *extra_style,
+    ]))
+    return table
 
 
 class PDFReportGenerator:
@@ -201,50 +257,14 @@ class PDFReportGenerator:
             # New members section
             if new_members:
                 story.append(Paragraph("New Members", self.styles['Heading3']))
-                new_data = [['Display Name', 'User Principal Name', 'Email']]
-                for member in new_members:
-                    new_data.append([
-                        member.display_name,
-                        member.user_principal_name,
-                        member.mail or 'N/A'
-                    ])
-                
-                new_table = Table(new_data, colWidths=[2*inch, 2.5*inch, 2*inch])
-                new_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.darkgreen),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, 0), 12),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.lightgreen),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
+                new_table = member_table(new_members, colors.darkgreen, colors.lightgreen)
                 story.append(new_table)
                 story.append(Spacer(1, 20))
             
             # Removed members section
             if removed_members:
                 story.append(Paragraph("Removed Members", self.styles['Heading3']))
-                removed_data = [['Display Name', 'User Principal Name', 'Email']]
-                for member in removed_members:
-                    removed_data.append([
-                        member.display_name,
-                        member.user_principal_name,
-                        member.mail or 'N/A'
-                    ])
-                
-                removed_table = Table(removed_data, colWidths=[2*inch, 2.5*inch, 2*inch])
-                removed_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.darkorange),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, 0), 12),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.bisque),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
+                removed_table = member_table(removed_members, colors.darkorange, colors.bisque)
                 story.append(removed_table)
                 story.append(Spacer(1, 20))
         else:
@@ -254,26 +274,13 @@ class PDFReportGenerator:
         # Complete member list
         if unchanged_members:
             story.append(Paragraph("Current Members (Unchanged)", self.section_style))
-            unchanged_data = [['Display Name', 'User Principal Name', 'Email']]
-            for member in sorted(unchanged_members, key=lambda x: x.display_name.lower()):
-                unchanged_data.append([
-                    member.display_name,
-                    member.user_principal_name,
-                    member.mail or 'N/A'
-                ])
-            
-            unchanged_table = Table(unchanged_data, colWidths=[2*inch, 2.5*inch, 2*inch])
-            unchanged_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-            ]))
+            # sorted() computes each lower-cased key once, not once per comparison
+            unchanged_table = member_table(
+                sorted(unchanged_members, key=lambda x: x.display_name.lower()),
+                colors.darkblue,
+                colors.lightgrey,
+                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+            )
             story.append(unchanged_table)
         
         doc.build(story)
@@ -319,23 +326,25 @@ class GroupMembershipPipeline:
     def load_previous_members(self) -> List[GroupMember]:
         """Load previously stored member list"""
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
+            with open(self.data_file, 'rb') as f:
+                data = orjson.loads(f.read())
                 print(f"Loaded previous member data from {data.get('last_updated', 'unknown date')}")
                 return [GroupMember.from_dict(member) for member in data['members']]
         except FileNotFoundError:
             print("No previous member data found. This will be treated as initial run.")
             return []
     
-    def save_current_members(self, members: List[GroupMember]):
-        """Save current member list for future comparison"""
+    def save_current_members(self, members: List[GroupMember], last_updated: str = None, path: str = None):
+        """Save current member list for future comparison, stamped with last_updated (defaults to now)"""
+        path = path or self.data_file
+        # orjson serializes the GroupMember dataclasses directly, using the field names as keys
         data = {
-            'last_updated': datetime.datetime.now().isoformat(),
-            'members': [member.to_dict() for member in members]
+            'last_updated': last_updated or datetime.datetime.now().isoformat(),
+            'members': members
         }
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f, indent=2)
-        print(f"Current member list saved to {self.data_file}")
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        print(f"Current member list saved to {path}")
     
     def run(self):
         """Execute the complete pipeline"""
@@ -344,22 +353,20 @@ class GroupMembershipPipeline:
             print("Starting Azure Entra Group Membership Comparison Pipeline")
             print("=" * 60)
             
-            # Fetch current members
-            print(f"\n1. Fetching current members for group: {self.config['group_id']}")
-            current_members = self.entra_manager.get_group_members(self.config['group_id'])
-            print(f"   ✓ Found {len(current_members)} current members")
-            
             # Load previous members
-            print(f"\n2. Loading previous member data...")
+            print(f"\n1. Loading previous member data...")
             previous_members = self.load_previous_members()
             print(f"   ✓ Loaded {len(previous_members)} previous members")
             
-            # Compare memberships
-            print(f"\n3. Comparing memberships...")
-            comparator = MembershipComparator()
-            new_members, removed_members, unchanged_members = comparator.compare_memberships(
-                current_members, previous_members
+            # Fetch current members and compare them as each page arrives,
+            # instead of materializing the full list and diffing it afterwards
+            print(f"\n2. Fetching and comparing current members for group: {self.config['group_id']}")
+            new_members, removed_members, unchanged_members = self.entra_manager.fetch_and_classify(
+                self.config['group_id'],
+                {member.id: member for member in previous_members}
             )
+            current_members = unchanged_members + new_members
+            print(f"   ✓ Found {len(current_members)} current members")
             
             print(f"   ✓ Comparison results:")
             print(f"     - New members: {len(new_members)}")
@@ -372,24 +379,39 @@ class GroupMembershipPipeline:
             print(f"##vso[task.setvariable variable=NewMembersCount;isOutput=true]{len(new_members)}")
             print(f"##vso[task.setvariable variable=RemovedMembersCount;isOutput=true]{len(removed_members)}")
             
-            # Generate PDF report
-            print(f"\n4. Generating PDF report...")
-            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+            # Generate PDF report and save current members for next comparison.
+            # The JSON is written to a temp file alongside the ReportLab build and only moved
+            # into place once the report succeeds, so a failed run never advances the saved state
+            print(f"\n3. Generating PDF report and saving current member data...")
+            # One clock read so the file name, report date and saved timestamp all agree
+            now = datetime.datetime.now()
+            timestamp = now.strftime('%Y%m%d_%H%M%S')
             report_filename = os.path.join(self.reports_dir, f"membership_report_{timestamp}.pdf")
             
             pdf_generator = PDFReportGenerator(report_filename)
-            pdf_generator.generate_report(
-                self.config['group_name'],
-                new_members,
-                removed_members,
-                unchanged_members,
-                datetime.datetime.now()
-            )
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                report_future = executor.submit(
+                    pdf_generator.generate_report,
+                    self.config['group_name'],
+                    new_members,
+                    removed_members,
+                    unchanged_members,
+                    now
+                )
+                pending_file = f"{self.data_file}.tmp"
+                save_future = executor.submit(
+                    self.save_current_members, current_members, now.isoformat(), pending_file
+                )
+                try:
+                    report_future.result()
+                    save_future.result()
+                except Exception:
+                    save_future.exception()
+                    if os.path.exists(pending_file):
+                        os.remove(pending_file)
+                    raise
+            os.replace(pending_file, self.data_file)
             print(f"   ✓ PDF report generated: {report_filename}")
-            
-            # Save current members for next comparison
-            print(f"\n5. Saving current member data for next comparison...")
-            self.save_current_members(current_members)
             print(f"   ✓ Current member list saved")
             
             # Summary
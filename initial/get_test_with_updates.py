@@ -1,141 +1,272 @@
 import os
-import json
+import sys
+import time
+import random
+import mmap
+import orjson
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 import requests as req
+from html import escape
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from msal import ConfidentialClientApplication
 
 # ------------------ Authentication ------------------
 filter_query = os.environ.get('GROUPS_FILTER')
-def get_token():
-    tenant_id = os.environ.get('TENANT_ID')
-    client_id = os.environ.get('CLIENT_ID')
-    client_secret = os.environ.get('CLIENT_SECRET')
-    
-    if not all([tenant_id, client_id, client_secret]):
-        raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+_msal_app = None
+
+def get_msal_app():
+    # Build the MSAL client once so its in-memory token cache is shared across calls
+    global _msal_app
+    if _msal_app is None:
+        tenant_id = os.environ.get('TENANT_ID')
+        client_id = os.environ.get('CLIENT_ID')
+        client_secret = os.environ.get('CLIENT_SECRET')
+
+        if not all([tenant_id, client_id, client_secret]):
+            raise Exception("Missing environment variables: TENANT_ID, CLIENT_ID, CLIENT_SECRET")
 
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
-    token_result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+        authority = f"https://login.microsoftonline.com/{tenant_id}"
+        _msal_app = ConfidentialClientApplication(client_id, client_secret, authority=authority)
+    return _msal_app
+
+def get_token():
+    app = get_msal_app()
+    token_result = app.acquire_token_silent(GRAPH_SCOPES, account=None)
+    if not token_result:
+        token_result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
 
     if "access_token" in token_result:
         return token_result["access_token"]
     else:
         raise Exception(f"Token error: {token_result.get('error_description')}")
 
+# ------------------ HTTP ------------------
+# One pooled session so Graph calls reuse keep-alive connections instead of a new TLS handshake each time
+SESSION = req.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        # 429/503 throttling is handled by graph_request so POSTs are covered too
+        status_forcelist=[500, 502, 504],
+        raise_on_status=False,
+    ),
+))
+MAX_THROTTLE_RETRIES = 5
+
+def graph_request(method, url, **kwargs):
+    """Send a Graph request, waiting out 429/503 throttling via Retry-After or jittered exponential backoff."""
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        response = SESSION.request(method, url, **kwargs)
+        if response.status_code not in (429, 503) or attempt == MAX_THROTTLE_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+        time.sleep(delay + random.uniform(0, 1))
+
 # ------------------ Group Fetching ------------------
 def get_groups():
     token = get_token()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
+    url = "https://graph.microsoft.com/v1.0/groups?$select=id,displayName&$top=999"
     if filter_query:
-        url = f"https://graph.microsoft.com/v1.0/groups?{filter_query}"
-    else:
-        url = "https://graph.microsoft.com/v1.0/groups"
+        url += f"&{filter_query}"
+
+    # Follow @odata.nextLink so tenants with more groups than one page aren't truncated
+    groups = []
+    while url:
+        response = graph_request("GET", url, headers=headers)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        groups.extend(data.get("value", []))
+        url = data.get("@odata.nextLink")
+    return groups
+
+GRAPH_BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+# Cap concurrent $batch posts so parallel fan-out doesn't trip Graph throttling (429)
+MAX_BATCH_WORKERS = 8
+
+MAX_BATCH_ATTEMPTS = 5
+# C-level accessor for the only member field that is kept
+get_display_name = itemgetter("displayName")
+
+def post_batch(batch_payload, headers):
+    """POST a $batch payload and return its sub-responses, re-sending any that come back throttled."""
+    responses = {}
+    pending = batch_payload["requests"]
+    for attempt in range(1, MAX_BATCH_ATTEMPTS + 1):
+        response = graph_request("POST", GRAPH_BATCH_URL, headers=headers, json={"requests": pending})
+        response.raise_for_status()
 
-    response = req.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json().get("value", [])
+        throttled = set()
+        retry_after = 1
+        # A full batch holds up to 20 member pages, so parse it with orjson rather than response.json()
+        for result in orjson.loads(response.content)["responses"]:
+            if result["status"] == 429 and attempt < MAX_BATCH_ATTEMPTS:
+                throttled.add(result["id"])
+                retry_after = max(retry_after, int(result.get("headers", {}).get("Retry-After", 1)))
+            else:
+                responses[result["id"]] = result
+
+        if not throttled:
+            break
+        time.sleep(retry_after)
+        pending = [r for r in pending if r["id"] in throttled]
+    return list(responses.values())
 
 def get_all_group_members():
     token = get_token()
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     groups = get_groups()
     group_members = {}
-    batch_requests = []
     batch_size = 20
-    batch_counter = 1
-
-    for group in groups:
-        batch_requests.append({
-            "id": str(batch_counter),
-            "method": "GET",
-            "url": f"/groups/{group['id']}/members"
-        })
-        batch_counter += 1
-
-        if len(batch_requests) == batch_size or group == groups[-1]:
-            batch_payload = {"requests": batch_requests}
-            response = req.post("https://graph.microsoft.com/v1.0/$batch", headers=headers, json=batch_payload)
-            response.raise_for_status()
-
-            results = response.json()["responses"]
-            for result in results:
-                idx = int(result["id"]) - 1
-                group_name = groups[idx]["displayName"]
-                if result["status"] == 200:
-                    members = [m["displayName"] for m in result["body"].get("value", [])]
-                    group_members[group_name] = members
-            batch_requests = []
+    # (group name, relative URL) for every member page still to be fetched
+    # Only displayName is kept, and 999 is the largest page Graph serves (default is 100)
+    pending = [
+        (group["displayName"], f"/groups/{group['id']}/members?$select=displayName&$top=999")
+        for group in groups
+    ]
+
+    # Batches are independent of each other, so each round is posted concurrently.
+    # Member lists longer than one page come back with a nextLink; those follow-ups are
+    # queued and sent in the next round of batches instead of one request per page
+    with ThreadPoolExecutor(max_workers=MAX_BATCH_WORKERS) as executor:
+        while pending:
+            chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            # Sub-request ids are the position inside their own batch, so each response maps straight back to its chunk
+            batch_payloads = [
+                {"requests": [{"id": str(i), "method": "GET", "url": url} for i, (_, url) in enumerate(chunk)]}
+                for chunk in chunks
+            ]
+            pending = []
+
+            for chunk, results in zip(chunks, executor.map(lambda payload: post_batch(payload, headers), batch_payloads)):
+                for result in results:
+                    group_name = chunk[int(result["id"])][0]
+                    # A dropped page would show up as deleted groups or removed members, so fail the run instead
+                    if result["status"] != 200:
+                        raise Exception(f"Member fetch failed for '{group_name}' ({result['status']}): {result.get('body')}")
+                    body = result["body"]
+                    # Interned so a user who sits in many groups is stored as one string object
+                    members = list(map(sys.intern, map(get_display_name, body.get("value", []))))
+                    group_members.setdefault(group_name, []).extend(members)
+
+                    next_link = body.get("@odata.nextLink")
+                    if next_link:
+                        pending.append((group_name, next_link.replace("https://graph.microsoft.com/v1.0", "", 1)))
+
+    # Keep member lists de-duplicated and sorted so they are saved that way and can be diffed with a
+    # linear merge; displayName is not unique, and the comparison treats members as a set of names
+    for group, members in group_members.items():
+        group_members[group] = sorted(set(members))
 
     return group_members
 
 # ------------------ Snapshot Handling ------------------
 def load_previous_snapshot():
     path = os.path.join(os.environ.get("PIPELINE_WORKSPACE", "./"),"group-report-artifacts","previous_snapshot.json")
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    print("No previous snapshot found, treating this as first run.")
-    return {}
+    # Open directly rather than checking os.path.exists first: one syscall fewer and no race
+    try:
+        # Parse straight from a read-only memory map instead of first copying the file into a bytes object
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                data = orjson.loads(view)
+    except FileNotFoundError:
+        print("No previous snapshot found, treating this as first run.")
+        return {}
+    # Snapshots from older runs may hold duplicate names or be unsorted
+    return {group: sorted(set(members)) for group, members in data.items()}
 
 def save_current_snapshot(data):
     artifacts_dir = os.environ.get('BUILD_ARTIFACTSTAGINGDIRECTORY', './pipeline-artifacts')
     os.makedirs(artifacts_dir, exist_ok=True)
-    with open(os.path.join(artifacts_dir, 'previous_snapshot.json'), 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2)
+    # Only read back by the next run, so it is written compact
+    with open(os.path.join(artifacts_dir, 'previous_snapshot.json'), 'wb') as f:
+        f.write(orjson.dumps(data))
 
 # ------------------ Comparison Logic ------------------
+def diff_sorted_members(cur, prev):
+    """Merge-walk two sorted member lists into sorted (added, removed, unchanged) lists."""
+    added, removed, unchanged = [], [], []
+    i = j = 0
+    while i < len(cur) and j < len(prev):
+        if cur[i] == prev[j]:
+            unchanged.append(cur[i])
+            i += 1
+            j += 1
+        elif cur[i] < prev[j]:
+            added.append(cur[i])
+            i += 1
+        else:
+            removed.append(prev[j])
+            j += 1
+    added += cur[i:]
+    removed += prev[j:]
+    return added, removed, unchanged
+
 def compare_snapshots(current, previous):
     result = {}
     all_keys = set(current.keys()).union(previous.keys())
     changes_detected = False
 
     for group in all_keys:
-        cur = set(current.get(group, []))
-        prev = set(previous.get(group, []))
-        added = list(cur - prev)
-        removed = list(prev - cur)
+        # Both snapshots hold sorted member lists, so an identical list means nothing changed
+        if group in current and current[group] == previous.get(group):
+            result[group] = {'added': [], 'removed': [], 'unchanged': current[group]}
+            continue
+
+        # Otherwise merge-walk the sorted lists: no hashing of names and no re-sorting
+        added, removed, unchanged = diff_sorted_members(current.get(group, []), previous.get(group, []))
 
         if added or removed:
             changes_detected = True
         result[group] = {
-            'added': sorted(added),
-            'removed': sorted(removed),
-            'unchanged': sorted(cur & prev)
+            'added': added,
+            'removed': removed,
+            'unchanged': unchanged
         }
 
     return result, changes_detected
 #-------------------Generate Report----------
+REPORT_WRITE_BUFFER = 64 * 1024
+
 def generate_html_report(snapshot, output_path):
-    html = [
-        "<html><head><style>",
-        "body { font-family: Arial, sans-serif; }",
-        "h2 { color: #333; }",
-        ".added { color: green; }",
-        ".removed { color: darkorange; }",
-        ".unchanged { color: black; }",
-        "table { border-collapse: collapse; width: 100%; }",
-        "th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }",
-        "</style></head><body>",
-        "<h1>Azure AD Group Membership Report</h1>"
-    ]
+    # Lines go straight to the file instead of being collected in a list and joined
+    with open(output_path, 'w', encoding='utf-8', buffering=REPORT_WRITE_BUFFER) as f:
+        def write(line):
+            f.write(line)
+            f.write("\n")
 
-    for group, data in snapshot.items():
-        html.append(f"<h2>{group}</h2>")
-        html.append("<table><tr><th>Change Type</th><th>Members</th></tr>")
+        write("<html><head><style>")
+        write("body { font-family: Arial, sans-serif; }")
+        write("h2 { color: #333; }")
+        write(".added { color: green; }")
+        write(".removed { color: darkorange; }")
+        write(".unchanged { color: black; }")
+        write("table { border-collapse: collapse; width: 100%; }")
+        write("th, td { padding: 8px 12px; border: 1px solid #ccc; text-align: left; }")
+        write("</style></head><body>")
+        write("<h1>Azure AD Group Membership Report</h1>")
 
-        for change_type in ["added", "removed", "unchanged"]:
-            class_name = change_type
-            for member in data.get(change_type, []):
-                html.append(f"<tr><td class='{class_name}'>{change_type.capitalize()}</td><td class='{class_name}'>{member}</td></tr>")
+        for group, data in snapshot.items():
+            write(f"<h2>{escape(group)}</h2>")
+            write("<table><tr><th>Change Type</th><th>Members</th></tr>")
 
-        html.append("</table><br>")
+            for change_type in ["added", "removed", "unchanged"]:
+                class_name = change_type
+                for member in data.get(change_type, []):
+                    write(f"<tr><td class='{class_name}'>{change_type.capitalize()}</td><td class='{class_name}'>{escape(member)}</td></tr>")
 
-    html.append("</body></html>")
+            write("</table><br>")
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
+        write("</body></html>")
 
 # ------------------ Entry ------------------
 def main():
@@ -157,10 +288,16 @@ def main():
     save_current_snapshot(current)
 
     print("Snapshot comparison complete.")
+    print(f"##vso[task.setvariable variable=ChangesDetected]{str(changes).lower()}")
+
+    # Nothing changed: the previous snapshot already describes every group, so skip the report outputs
+    if not changes:
+        print("No membership changes detected; skipping comparison result and HTML report.")
+        return
 
     # Save comparison result
-    with open(os.path.join(artifacts_dir, 'comparison_result.json'), 'w', encoding='utf-8') as f:
-        json.dump(snapshot, f, indent=2)
+    with open(os.path.join(artifacts_dir, 'comparison_result.json'), 'wb') as f:
+        f.write(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2))
 
     # Generate HTML report
     html_report_path = os.path.join(artifacts_dir, 'group_membership_report.html')